@@ -1,12 +1,22 @@
 import asyncio
+import json
 import os
-import re
+import sqlite3
+import time
 from collections import Counter
 from datetime import datetime
+from typing import NamedTuple
+from urllib.parse import quote_plus, urlparse
 
 import gspread
+import httpx
+from google.auth.transport.requests import AuthorizedSession
 from google.oauth2.service_account import Credentials
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from playwright.async_api import TimeoutError as PWTimeout
 from playwright.async_api import async_playwright
+from selectolax.parser import HTMLParser
 
 # — Proxy 설정 제거 (직접 연결 보장)
 os.environ.pop('HTTP_PROXY', None)
@@ -19,69 +29,424 @@ SPREADSHEET_ID = '1GSro604hDjybH5bhOQ4h_ZtcMCi_QdV-9ZYnMnH5kdo'
 CODE_SHEET = 'code'
 LIST_SHEET = 'list'
 
+# — 시트에 이미 올린 URL 로컬 캐시 (동기화 주기 안에서는 list!E 전체를 다시 읽지 않음)
+#   RESEED_SEEN=1 이면 이번 실행에서 시트 기준으로 강제 재동기화
+SEEN_DB_FILE = 'seen.sqlite'
+SEEN_RESYNC_INTERVAL = int(os.getenv("SEEN_RESYNC_INTERVAL", "86400"))  # 초
+
+# — 동시 크롤링 개수 / 브라우저 컨텍스트 풀 크기
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", "5"))
+CONTEXT_POOL_SIZE = MAX_CONCURRENCY  # 동시 크롤링마다 컨텍스트 1개
+
+# — 타임아웃 (페이지 이동/셀렉터 대기는 ms, 키워드 1건의 브라우저 수집 전체는 초)
+NAV_TIMEOUT = 15000
+SELECTOR_TIMEOUT = 10000
+CRAWL_TIMEOUT = 45
+# 스크롤은 셀렉터 대기 + 추출 시간을 남겨 두고 멈춤 (결과가 많아도 일부는 수집)
+SCROLL_RESERVE = SELECTOR_TIMEOUT / 1000 + 5
+MAX_SCROLLS = 50
+
+# — 키워드별 마지막 크롤링 시각/ETag 캐시 (TTL 이내면 크롤링 생략)
+CRAWL_STATE_FILE = 'crawl_state.json'
+CRAWL_TTL = int(os.getenv("CRAWL_TTL", "1800"))  # 초
+NOT_MODIFIED = object()
+
+# — Buyee URL 템플릿 (키워드는 quote_plus 로 인코딩해서 넣음)
+SEARCH_TMPL = "https://buyee.jp/mercari/search?keyword={}"
+IFRAME_TMPL = (
+    "https://asf.buyee.jp/mercari?keyword={}"
+    "&conversionType=Mercari_DirectSearch"
+    "&currencyCode=KRW&myee=0&languageCode=en&lang=en"
+)
+
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/115.0.0.0 Safari/537.36"
+)
+
+# — 크롤링에 필요 없는 요청 차단 (img src 는 DOM 에서 그대로 읽힘)
+BLOCKED_RESOURCE_TYPES = {"image", "font", "media", "stylesheet"}
+BLOCKED_DOMAINS = (
+    "googletagmanager", "doubleclick", "google-analytics", "recaptcha", "facebook",
+)
+
+# — 봇 차단/챌린지 페이지 판별용 문자열 (소문자 비교)
+#   정상 페이지도 recaptcha 스크립트 등을 싣기 때문에 "captcha" 같은 넓은 문자열은 쓰지 않음
+CHALLENGE_MARKERS = (
+    "cf-challenge", "cf-chl-", "challenge-platform",
+    "<title>just a moment", "<title>access denied", "<title>attention required",
+)
+
+# — 가격 문자열에서 숫자(str.isdecimal, 전각 １２３ 포함)만 남기는 str.translate 테이블
+#   (¥, 円, 쉼표 등 처음 보는 문자는 삭제 대상으로 기록해 두고 재사용, int() 는 전각 숫자도 변환)
+class _KeepDigits(dict):
+    def __missing__(self, key):
+        value = key if chr(key).isdecimal() else None
+        self[key] = value
+        return value
+
+_KEEP_DIGITS = _KeepDigits()
+
+# — 상품 링크 top class 캐시 (호스트 단위, 키워드 간 공유)
+_TOP_CLASS_CACHE: dict[str, str] = {}
+
+class Item(NamedTuple):
+    code: str
+    title: str
+    price: str
+    image: str
+    url: str
+    date: str
+
 def get_sheets():
     creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-    client = gspread.authorize(creds)
+    # Sheets API 호출 간 커넥션 재사용 + 일시 오류 재시도
+    session = AuthorizedSession(creds)
+    session.mount("https://", HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=10,
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504)),
+    ))
+    client = gspread.Client(auth=creds, session=session)
     ss = client.open_by_key(SPREADSHEET_ID)
-    return ss.worksheet(CODE_SHEET), ss.worksheet(LIST_SHEET)
+    return ss, ss.worksheet(LIST_SHEET)
+
+def read_sheets(ss, with_urls=True):
+    # code!A:B(코드, 최대가격) (+ list!E(URL)) 를 한 번의 요청으로 열 단위(COLUMNS)로 읽기
+    # → 행마다 [값] 리스트를 만들지 않고 열 리스트를 그대로 사용
+    ranges = [f"{CODE_SHEET}!A2:B"]
+    if with_urls:
+        ranges.append(f"{LIST_SHEET}!E2:E")
+    value_ranges = ss.values_batch_get(
+        ranges, params={"majorDimension": "COLUMNS"},
+    )["valueRanges"]
+    code_cols = value_ranges[0].get("values", [])
+    codes   = code_cols[0] if code_cols else []
+    max_raw = code_cols[1] if len(code_cols) > 1 else []
+    # 뒤쪽 빈 셀은 응답에서 잘리므로 코드 개수에 맞춰 채움
+    max_raw = max_raw + [""] * (len(codes) - len(max_raw))
+    urls = (value_ranges[1].get("values") or [[]])[0] if with_urls else []
+    return codes, max_raw, urls
+
+def open_seen_db():
+    conn = sqlite3.connect(SEEN_DB_FILE)
+    conn.execute("CREATE TABLE IF NOT EXISTS seen(url TEXT PRIMARY KEY)")
+    conn.execute("CREATE TABLE IF NOT EXISTS meta(key TEXT PRIMARY KEY, value TEXT)")
+    return conn
+
+def seen_needs_resync(conn):
+    if os.getenv("RESEED_SEEN") == "1":
+        return True
+    row = conn.execute("SELECT value FROM meta WHERE key = 'synced_at'").fetchone()
+    return row is None or time.time() - float(row[0]) >= SEEN_RESYNC_INTERVAL
+
+def resync_seen(conn, urls):
+    # 시트에서 지운 URL 도 다시 올라갈 수 있도록 시트 내용으로 통째로 교체
+    conn.execute("DELETE FROM seen")
+    conn.executemany("INSERT OR IGNORE INTO seen(url) VALUES (?)", ((u,) for u in urls))
+    conn.execute(
+        "INSERT OR REPLACE INTO meta(key, value) VALUES ('synced_at', ?)", (str(time.time()),)
+    )
+    conn.commit()
+
+def is_seen(conn, url):
+    return conn.execute("SELECT 1 FROM seen WHERE url = ?", (url,)).fetchone() is not None
 
-async def auto_scroll(page):
+def remember_urls(conn, urls):
+    conn.executemany("INSERT OR IGNORE INTO seen(url) VALUES (?)", ((u,) for u in urls))
+    conn.commit()
+
+# 초 단위로 캐시한 "YYYY-mm-dd HH:MM:SS" (같은 초 안에서는 재포맷하지 않음)
+_last_sec = [0, ""]
+
+def now_str():
+    sec = int(time.time())
+    if sec != _last_sec[0]:
+        _last_sec[:] = [sec, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(sec))]
+    return _last_sec[1]
+
+def load_crawl_state():
+    try:
+        with open(CRAWL_STATE_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_crawl_state(state):
+    with open(CRAWL_STATE_FILE, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+
+# 셀 값을 userEnteredValue 로 직접 지정 (구분자 파싱을 거치지 않아 따옴표/탭이 그대로 보존됨)
+# (수식은 D열 =IMAGE 만, '=' 로 시작하는 상품명은 문자열 그대로)
+def sheet_cell(value, formula=False):
+    if not value:
+        return {}
+    if formula:
+        return {"userEnteredValue": {"formulaValue": value}}
+    return {"userEnteredValue": {"stringValue": value}}
+
+# 날짜(F열)는 USER_ENTERED 때처럼 날짜 값으로 넣어야 기존 행과 정렬이 섞이지 않음
+_SHEETS_EPOCH = datetime(1899, 12, 30)
+
+def date_cell(value):
+    serial = (datetime.strptime(value, "%Y-%m-%d %H:%M:%S") - _SHEETS_EPOCH).total_seconds() / 86400
+    return {
+        "userEnteredValue": {"numberValue": serial},
+        "userEnteredFormat": {"numberFormat": {"type": "DATE_TIME", "pattern": "yyyy-mm-dd hh:mm:ss"}},
+    }
+
+def write_rows(ss, list_ws, new_rows):
+    # 2행에 빈 행 삽입 + 셀 값 기록 + 날짜(F열) 내림차순 정렬을 한 번에
+    sheet_id = list_ws.id
+    ss.batch_update({"requests": [
+        {"insertDimension": {
+            "range": {
+                "sheetId": sheet_id, "dimension": "ROWS",
+                "startIndex": 1, "endIndex": 1 + len(new_rows),
+            },
+            "inheritFromBefore": False,
+        }},
+        {"updateCells": {
+            "start": {"sheetId": sheet_id, "rowIndex": 1, "columnIndex": 0},
+            "rows": [
+                {"values": [
+                    sheet_cell(row[0]), sheet_cell(row[1]), sheet_cell(row[2]),
+                    sheet_cell(row[3], formula=True), sheet_cell(row[4]), date_cell(row[5]),
+                ]}
+                for row in new_rows
+            ],
+            "fields": "userEnteredValue,userEnteredFormat.numberFormat",
+        }},
+        {"sortRange": {
+            "range": {"sheetId": sheet_id, "startRowIndex": 1},
+            "sortSpecs": [{"dimensionIndex": 5, "sortOrder": "DESCENDING"}],
+        }},
+    ]})
+
+async def auto_scroll(page, deadline):
+    # 고정 sleep 대신 높이가 늘어날 때까지만 대기, 더 안 늘어나거나 deadline/횟수 초과면 종료
+    loop = asyncio.get_running_loop()
     prev_height = await page.evaluate("() => document.body.scrollHeight")
-    while True:
+    for _ in range(MAX_SCROLLS):
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
         await page.evaluate("() => window.scrollTo(0, document.body.scrollHeight)")
-        await asyncio.sleep(1)
-        new_height = await page.evaluate("() => document.body.scrollHeight")
-        if new_height == prev_height:
+        try:
+            await page.wait_for_function(
+                "prev => document.body.scrollHeight > prev",
+                arg=prev_height,
+                timeout=min(1500, remaining * 1000),
+            )
+        except PWTimeout:
             break
-        prev_height = new_height
+        prev_height = await page.evaluate("() => document.body.scrollHeight")
 
-async def crawl_buyee(keyword: str) -> list[dict]:
-    search_url = f"https://buyee.jp/mercari/search?keyword={keyword}"
+def find_top_class(html):
+    counter = Counter(
+        cls
+        for a in HTMLParser(html).css('a[href*="/item/"]')
+        for cls in (a.attributes.get("class") or "").split()
+    )
+    return counter.most_common(1)[0][0] if counter else None
+
+async def launch_browser(pw):
     proxy_server = os.getenv("RESIDENTIAL_PROXY")  # 선택적 residential proxy
+    launch_opts = {
+        "headless": True,
+        "args": [
+            "--disable-blink-features=AutomationControlled",
+            "--no-sandbox",
+            "--disable-setuid-sandbox",
+        ],
+    }
+    if proxy_server:
+        launch_opts["proxy"] = {"server": proxy_server}
+    return await pw.chromium.launch(**launch_opts)
 
-    async with async_playwright() as pw:
-        launch_opts = {
-            "headless": True,
-            "args": [
-                "--disable-blink-features=AutomationControlled",
-                "--no-sandbox",
-                "--disable-setuid-sandbox",
-            ],
-        }
-        if proxy_server:
-            launch_opts["proxy"] = {"server": proxy_server}
-
-        browser = await pw.chromium.launch(**launch_opts)
-        context = await browser.new_context(
-            user_agent=(
-                "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                "AppleWebKit/537.36 (KHTML, like Gecko) "
-                "Chrome/115.0.0.0 Safari/537.36"
-            ),
-            viewport={"width": 1920, "height": 1080},
+async def block_unneeded(route):
+    req = route.request
+    # 도메인은 호스트에만 매칭 (쿼리스트링의 키워드에 걸리지 않도록)
+    host = urlparse(req.url).hostname or ""
+    if req.resource_type in BLOCKED_RESOURCE_TYPES or any(d in host for d in BLOCKED_DOMAINS):
+        await route.abort()
+    else:
+        await route.continue_()
+
+async def new_context(browser):
+    context = await browser.new_context(
+        user_agent=USER_AGENT,
+        viewport={"width": 1920, "height": 1080},
+    )
+    # Headless 탐지 회피
+    await context.add_init_script(
+        "() => { Object.defineProperty(navigator, 'webdriver', { get: () => undefined }); }"
+    )
+    await context.route("**/*", block_unneeded)
+    return context
+
+class ContextPool:
+    # Playwright/브라우저/컨텍스트는 첫 fallback 때에만 띄운다
+    # (httpx 로 전부 처리되면 Chromium 을 아예 실행하지 않음)
+    def __init__(self, size):
+        self.size = size
+        self.pw = None
+        self.browser = None
+        self._queue = asyncio.Queue()
+        self._lock = asyncio.Lock()
+
+    async def get(self):
+        async with self._lock:
+            if self.browser is None:
+                await self._start()
+        return await self._queue.get()
+
+    async def _start(self):
+        # 전부 성공한 뒤에만 self 에 반영 (중간 실패/취소 시 띄운 것은 정리)
+        pw = browser = None
+        try:
+            pw = await async_playwright().start()
+            browser = await launch_browser(pw)
+            contexts = [await new_context(browser) for _ in range(self.size)]
+        except BaseException:
+            if browser is not None:
+                await browser.close()
+            if pw is not None:
+                await pw.stop()
+            raise
+        self.pw, self.browser = pw, browser
+        for context in contexts:
+            self._queue.put_nowait(context)
+
+    def put_nowait(self, context):
+        self._queue.put_nowait(context)
+
+    async def close(self):
+        if self.browser is not None:
+            await self.browser.close()
+        if self.pw is not None:
+            await self.pw.stop()
+
+def new_http_client():
+    return httpx.AsyncClient(
+        http2=True,
+        headers={"User-Agent": USER_AGENT},
+        proxy=os.getenv("RESIDENTIAL_PROXY") or None,
+        timeout=NAV_TIMEOUT / 1000,
+        limits=httpx.Limits(max_keepalive_connections=20),
+    )
+
+def make_item(keyword, title, price, image, href, date):
+    href = href.replace("/undefined/", "/")
+    return Item(
+        code=keyword,
+        title=title,
+        price=price,
+        image=image,
+        url=href if href.startswith("http") else f"https://buyee.jp{href}",
+        date=date,
+    )
+
+def looks_like_challenge(tree, html):
+    # 챌린지 문구가 있거나, 본문 텍스트가 없는 JS 셸이면 정상 결과 페이지로 보지 않음
+    lowered = html.lower()
+    if any(m in lowered for m in CHALLENGE_MARKERS):
+        return True
+    return tree.body is None or not tree.body.text(strip=True)
+
+# 브라우저 없이 iframe 페이지를 직접 받아 파싱 (챌린지/비정상 응답이면 None → Playwright 사용)
+# 정상 페이지인데 상품 카드가 없으면 검색 결과 0건으로 보고 [] 반환
+# cache["etag"] 가 있으면 조건부 요청을 보내고, 304 면 NOT_MODIFIED 반환
+# 새 ETag 는 staged 에만 기록 (시트 쓰기 성공 후 crawl_state 에 반영)
+async def fetch_iframe_items(client, keyword: str, iframe_src: str, cache: dict, staged: dict, crawled_at: str, log_lines: list):
+    headers = {"If-None-Match": cache["etag"]} if cache.get("etag") else {}
+    try:
+        # httpx timeout 은 연결/읽기 단계별이라 느리게 흘러오는 응답을 못 끊으므로 전체 시간도 제한
+        resp = await asyncio.wait_for(
+            client.get(iframe_src, headers=headers), NAV_TIMEOUT / 1000
         )
-        # Headless 탐지 회피
-        await context.add_init_script(
-            "() => { Object.defineProperty(navigator, 'webdriver', { get: () => undefined }); }"
+    except (httpx.HTTPError, asyncio.TimeoutError) as e:
+        log_lines.append(f"⚠️ {keyword}: httpx 요청 실패 ({e!r})")
+        return None
+    if resp.status_code == 304:
+        return NOT_MODIFIED
+    if resp.status_code != 200:
+        return None
+
+    tree = HTMLParser(resp.text)
+    if looks_like_challenge(tree, resp.text):
+        return None
+    links = tree.css("a.simple_container__llX1q")
+
+    items = []
+    for link in links:
+        # sold-out 제외
+        if link.css_first("span.sold_text__yvzaS"):
+            continue
+        title_el = link.css_first("span.simple_name__XMcbt")
+        price_el = link.css_first("span.simple_price__h13DP")
+        img_el   = link.css_first("img")
+        items.append(make_item(
+            keyword,
+            title_el.text(strip=True) if title_el else "",
+            price_el.text(strip=True) if price_el else "",
+            (img_el.attributes.get("src") or "") if img_el else "",
+            link.attributes.get("href") or "",
+            crawled_at,
+        ))
+    if resp.headers.get("ETag"):
+        staged["etag"] = resp.headers["ETag"]
+    return items
+
+# 변경 없음(304)이면 None, 아니면 수집한 항목 리스트
+async def crawl_buyee(context_pool, client, keyword: str, cache: dict, staged: dict, log_lines: list) -> list[Item] | None:
+    # 한 번의 크롤링에서 수집한 항목은 같은 시각을 공유
+    crawled_at = now_str()
+    quoted = quote_plus(keyword)
+    search_url = SEARCH_TMPL.format(quoted)
+    iframe_url = IFRAME_TMPL.format(quoted)
+
+    # 0) httpx 로 iframe 직접 요청 (성공하면 브라우저 생략)
+    items = await fetch_iframe_items(client, keyword, iframe_url, cache, staged, crawled_at, log_lines)
+    if items is NOT_MODIFIED:
+        return None
+    if items is not None:
+        return items
+
+    # 풀에서 컨텍스트를 빌린 뒤에 타임아웃 시작 (브라우저 기동/컨텍스트 대기 시간은 제외)
+    context = await context_pool.get()
+    try:
+        return await asyncio.wait_for(
+            scrape_with_browser(context, keyword, search_url, iframe_url, crawled_at),
+            CRAWL_TIMEOUT,
         )
+    finally:
+        context_pool.put_nowait(context)
+
+# 컨텍스트에 페이지만 새로 열어 수집 (페이지는 닫고 컨텍스트는 호출 측에서 반납)
+async def scrape_with_browser(context, keyword: str, search_url: str, iframe_url: str, crawled_at: str) -> list[Item]:
+    scroll_deadline = asyncio.get_running_loop().time() + CRAWL_TIMEOUT - SCROLL_RESERVE
+    page = None
+    try:
         page = await context.new_page()
 
-        # 1) 검색 페이지 로드
-        await page.goto(search_url, wait_until="networkidle", timeout=60000)
-
-        # 2) iframe src 찾기 또는 fallback
-        iframe_el = await page.query_selector('iframe[name="search_result_iframe"]')
-        iframe_src = await iframe_el.get_attribute("src") if iframe_el else None
-        if not iframe_src:
-            iframe_src = (
-                f"https://asf.buyee.jp/mercari?keyword={keyword}"
-                "&conversionType=Mercari_DirectSearch"
-                "&currencyCode=KRW&myee=0&languageCode=en&lang=en"
-            )
+        # 1) iframe URL 로 바로 이동 (검색 페이지 로드 1회 생략)
+        resp = await page.goto(iframe_url, wait_until="domcontentloaded", timeout=NAV_TIMEOUT)
 
-        # 3) iframe 로드 후 스크롤
-        await page.goto(iframe_src, wait_until="networkidle", timeout=60000)
-        await auto_scroll(page)
+        # 2) 실패 시 검색 페이지에서 iframe src 찾아 재시도
+        if resp is None or not resp.ok:
+            await page.goto(search_url, wait_until="domcontentloaded", timeout=NAV_TIMEOUT)
+            iframe_el = await page.query_selector('iframe[name="search_result_iframe"]')
+            iframe_src = await iframe_el.get_attribute("src") if iframe_el else None
+            # 바깥 검색 페이지를 긁지 않도록 다른 iframe src 가 없으면 실패 처리
+            if not iframe_src or iframe_src == iframe_url:
+                status = resp.status if resp else "no response"
+                raise RuntimeError(f"iframe 로드 실패 ({status}), 검색 페이지에 대체 iframe 없음")
+            await page.goto(iframe_src, wait_until="domcontentloaded", timeout=NAV_TIMEOUT)
+
+        # 3) 스크롤
+        await auto_scroll(page, scroll_deadline)
 
         # 4) CI 디버그
         if os.getenv("CI"):
@@ -91,97 +456,146 @@ async def crawl_buyee(keyword: str) -> list[dict]:
             print("===== END OF DUMP =====")
             await page.screenshot(path="ci-dump.png", full_page=True)
 
-        # 5) 동적 클래스 추출
-        html = await page.content()
-        classes = re.findall(
-            r'<a[^>]+href="[^"]*?/item/[^"]*"[^>]*class="([^"]+)"',
-            html
-        )
-        counter = Counter()
-        for cls_str in classes:
-            for cls in cls_str.split():
-                counter[cls] += 1
-        top_class = counter.most_common(1)[0][0] if counter else None
+        # 5) 동적 클래스 추출 (같은 레이아웃이면 캐시 재사용)
+        layout_key = urlparse(page.url).netloc
+        top_class = _TOP_CLASS_CACHE.get(layout_key)
+        if top_class is None:
+            top_class = find_top_class(await page.content())
+            if top_class:
+                _TOP_CLASS_CACHE[layout_key] = top_class
         selector = f'a.{top_class}' if top_class else 'a[href*="/item/"]'
 
-        # 6) 항목 수집
-        await page.wait_for_selector(selector, timeout=60000)
-        links = await page.query_selector_all(selector)
-
-        items = []
-        for link in links:
-            # sold-out 제외
-            if await link.query_selector("span.sold_text__yvzaS"):
-                continue
-
-            title_el = await link.query_selector("span.simple_name__XMcbt")
-            price_el = await link.query_selector("span.simple_price__h13DP")
-            img_el   = await link.query_selector("img")
-            href     = await link.get_attribute("href") or ""
-
-            # ← 이 한 줄만 추가했습니다:
-            href = href.replace("/undefined/", "/")
-
-            items.append({
-                "code":  keyword,
-                "title": (await title_el.inner_text()).strip() if title_el else "",
-                "price": (await price_el.inner_text()).strip() if price_el else "",
-                "image": await img_el.get_attribute("src") if img_el else "",
-                "url":   href if href.startswith("http") else f"https://buyee.jp{href}",
-                "date":  datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            })
-
-        await browser.close()
-        return items
+        # 6) 항목 수집 (CDP 왕복 1회로 일괄 추출, sold-out 제외)
+        try:
+            await page.wait_for_selector(selector, timeout=SELECTOR_TIMEOUT)
+        except PWTimeout:
+            # 레이아웃이 바뀌었을 수 있으므로 다음 키워드에서 다시 추출
+            _TOP_CLASS_CACHE.pop(layout_key, None)
+            raise
+        raw = await page.eval_on_selector_all(selector, """(els, {code, date}) => els
+            .filter(e => !e.querySelector('span.sold_text__yvzaS'))
+            .map(e => {
+                const href = (e.getAttribute('href') ?? '').replaceAll('/undefined/', '/');
+                return {
+                    code,
+                    title: (e.querySelector('span.simple_name__XMcbt')?.innerText ?? '').trim(),
+                    price: (e.querySelector('span.simple_price__h13DP')?.innerText ?? '').trim(),
+                    image: e.querySelector('img')?.getAttribute('src') ?? '',
+                    url:   href.startsWith('http') ? href : 'https://buyee.jp' + href,
+                    date,
+                };
+            })""", {"code": keyword, "date": crawled_at})
+        return [Item(**r) for r in raw]
+    finally:
+        if page is not None:
+            await page.close()
 
 async def main():
-    code_ws, list_ws = get_sheets()
-    codes   = code_ws.col_values(1)[1:]
-    max_raw = code_ws.col_values(2)[1:]
-
-    # 최대 가격 파싱
-    max_map = {}
-    for code, raw in zip(codes, max_raw):
-        clean = raw.replace(",", "").strip()
-        try:
-            max_map[code.strip()] = int(clean) if clean else None
-        except ValueError:
-            max_map[code.strip()] = None
+    ss, list_ws = get_sheets()
+    seen_db = open_seen_db()
+    resync = seen_needs_resync(seen_db)
+    codes, max_raw, urls = read_sheets(ss, with_urls=resync)
+    if resync:
+        # 첫 실행/동기화 주기 경과/RESEED_SEEN: 시트에서 읽은 URL 로 로컬 캐시 재구성
+        resync_seen(seen_db, urls)
 
-    existing_urls = set(list_ws.col_values(5)[1:])
+    codes = [c.strip() for c in codes]
+
+    # 최대 가격 파싱 (빈 값/숫자 아님 → None)
+    max_clean = (raw.replace(",", "").strip() for raw in max_raw)
+    max_map = {
+        code: (int(m) if m.isdecimal() else None)
+        for code, m in zip(codes, max_clean)
+        if code
+    }
+
+    # 기존 URL 중복 체크는 seen 테이블(PRIMARY KEY 인덱스)에 직접 조회
+    # 이번 실행에서 추가한 URL 은 시트 쓰기 성공 전까지 작은 set 에 따로 보관
+    new_urls_this_run = set()
     new_rows = []
 
-    for kw in codes:
-        limit = max_map.get(kw)
-        print(f"\n=== Crawling Buyee: {kw} (max={'∞' if limit is None else limit}엔) ===")
-        results = await crawl_buyee(kw)
+    crawl_state = load_crawl_state()
+    # 이번 실행에서 갱신할 키워드별 상태 (시트 쓰기가 성공한 뒤에만 저장)
+    pending_state = {}
+    # 진행 로그는 모아 두었다가 한 번에 출력 (병렬 크롤링 중 출력이 섞이지 않도록)
+    log_lines = []
+
+    # 키워드별 크롤링 병렬 실행 (세마포어로 동시 개수 제한)
+    sem = asyncio.Semaphore(MAX_CONCURRENCY)
 
+    context_pool = ContextPool(CONTEXT_POOL_SIZE)
+    async with new_http_client() as client:
+
+        async def bounded(kw):
+            limit = max_map.get(kw)
+            cache = crawl_state.get(kw, {})
+            # 최대 가격이 바뀌면 TTL/ETag 캐시를 버리고 다시 수집
+            if "limit" not in cache or cache["limit"] != limit:
+                cache = {}
+            if time.time() - cache.get("ts", 0) < CRAWL_TTL:
+                log_lines.append(f"⏭️ {kw}: TTL 이내, 크롤링 생략")
+                return None
+            staged = {"limit": limit}
+            async with sem:
+                log_lines.append(f"\n=== Crawling Buyee: {kw} (max={'∞' if limit is None else limit}엔) ===")
+                try:
+                    results = await crawl_buyee(context_pool, client, kw, cache, staged, log_lines)
+                except asyncio.TimeoutError:
+                    log_lines.append(f"⏱️ {kw}: {CRAWL_TIMEOUT}초 초과, 건너뜀")
+                    return None
+            staged["ts"] = time.time()
+            pending_state[kw] = {**cache, **staged}
+            if results is None:
+                log_lines.append(f"⏭️ {kw}: 변경 없음 (304)")
+            return results
+
+        try:
+            # 한 키워드의 실패가 나머지 크롤링을 중단시키지 않도록 예외도 결과로 수집
+            crawled = await asyncio.gather(
+                *(bounded(kw) for kw in codes), return_exceptions=True
+            )
+        finally:
+            await context_pool.close()
+
+    crawled_at = now_str()
+    for kw, results in zip(codes, crawled):
+        if isinstance(results, Exception):
+            log_lines.append(f"⚠️ {kw}: 크롤링 실패 ({results!r})")
+            continue
+        if results is None:
+            continue
+        limit = max_map.get(kw)
         if not results:
-            if "" not in existing_urls:
+            if "" not in new_urls_this_run and not is_seen(seen_db, ""):
                 new_rows.append([
-                    kw, "결과 없음", "", "", "",
-                    datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    kw, "결과 없음", "", "", "", crawled_at
                 ])
-                existing_urls.add("")
+                new_urls_this_run.add("")
         else:
             for it in results:
-                price_num = int(re.sub(r"[^\d]", "", it["price"])) if it["price"] else 0
+                price_num = int(it.price.translate(_KEEP_DIGITS) or "0")
                 if limit is not None and price_num > limit:
                     continue
-                if it["url"] in existing_urls:
+                if it.url in new_urls_this_run or is_seen(seen_db, it.url):
                     continue
-                img_formula = f'=IMAGE("{it["image"]}",1)' if it["image"] else ""
+                img_formula = f'=IMAGE("{it.image}",1)' if it.image else ""
                 new_rows.append([
-                    it["code"], it["title"], it["price"],
-                    img_formula, it["url"], it["date"]
+                    it.code, it.title, it.price,
+                    img_formula, it.url, it.date
                 ])
-                existing_urls.add(it["url"])
+                new_urls_this_run.add(it.url)
 
-        print(f"✅ {kw}: 누적 {len(new_rows)}개")
+        log_lines.append(f"✅ {kw}: 누적 {len(new_rows)}개")
+
+    print("\n".join(log_lines))
 
     if new_rows:
-        list_ws.insert_rows(new_rows, row=2, value_input_option="USER_ENTERED")
-        list_ws.sort((6, "des"))
+        write_rows(ss, list_ws, new_rows)
+        remember_urls(seen_db, new_urls_this_run)
+    seen_db.close()
+
+    crawl_state.update(pending_state)
+    save_crawl_state(crawl_state)
 
 if __name__ == "__main__":
     asyncio.run(main())